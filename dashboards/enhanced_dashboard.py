@@ -6,11 +6,21 @@ import sqlite3
 st.set_page_config(page_title="Clinical Trial Dashboard", layout="wide")
 st.title("🏥 Clinical Trial Risk-Based Monitoring Dashboard")
 
+@st.cache_data(ttl=300)
+def load_data():
+    conn = sqlite3.connect('data/clinical_data.db')
+    demographics = pd.read_sql('SELECT * FROM demographics', conn, dtype_backend='pyarrow')
+    adverse_events = pd.read_sql('SELECT * FROM adverse_events', conn, dtype_backend='pyarrow')
+    conn.close()
+    
+    # The page shows both full tables anyway, so the chart summaries come from the
+    # same cached frames and expire with them
+    site_data = demographics.groupby('site_id').size().reset_index(name='count')
+    ae_severity = adverse_events.groupby('severity').size().reset_index(name='count')
+    return demographics, adverse_events, site_data, ae_severity
+
 # Load data
-conn = sqlite3.connect('data/clinical_data.db')
-demographics = pd.read_sql('SELECT * FROM demographics', conn)
-adverse_events = pd.read_sql('SELECT * FROM adverse_events', conn)
-conn.close()
+demographics, adverse_events, site_data, ae_severity = load_data()
 
 # Key metrics
 col1, col2, col3, col4 = st.columns(4)
@@ -29,13 +39,11 @@ col1, col2 = st.columns(2)
 
 with col1:
     st.subheader("📊 Enrollment by Site")
-    site_data = demographics.groupby('site_id').size().reset_index(name='count')
     fig1 = px.bar(site_data, x='site_id', y='count', title="Subjects per Site")
     st.plotly_chart(fig1, use_container_width=True)
 
 with col2:
     st.subheader("⚠️ AE Severity Distribution")
-    ae_severity = adverse_events.groupby('severity').size().reset_index(name='count')
     fig2 = px.pie(ae_severity, values='count', names='severity', title="Adverse Events by Severity")
     st.plotly_chart(fig2, use_container_width=True)
 
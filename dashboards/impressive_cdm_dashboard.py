@@ -35,15 +35,32 @@ div[data-testid="metric-container"] {
 </style>
 """, unsafe_allow_html=True)
 
-@st.cache_data
+def apply_categorical_dtypes(demographics, adverse_events):
+    """Store low-cardinality columns as categoricals for faster grouping"""
+    for col in ['gender', 'treatment_arm']:
+        demographics[col] = demographics[col].astype('category')
+    demographics['site_id'] = demographics['site_id'].astype('int8')
+    
+    for col in ['ae_term', 'severity', 'related_to_study_drug']:
+        adverse_events[col] = adverse_events[col].astype('category')
+    
+    return demographics, adverse_events
+
+# Matches the sidebar's 30-second auto-refresh, so a rerun can pick up new data
+@st.cache_data(ttl=30)
 def load_clinical_data():
+    """Load both tables plus the load time, which keys every cache derived from them"""
+    loaded_at = datetime.now()
     try:
         conn = sqlite3.connect('data/clinical_data.db')
-        demographics = pd.read_sql('SELECT * FROM demographics', conn)
-        adverse_events = pd.read_sql('SELECT * FROM adverse_events', conn)
+        demographics = pd.read_sql('SELECT * FROM demographics ORDER BY enrollment_date', conn, dtype_backend='pyarrow')
+        adverse_events = pd.read_sql('SELECT * FROM adverse_events', conn, dtype_backend='pyarrow')
         conn.close()
-        return demographics, adverse_events
-    except:
+        return *apply_categorical_dtypes(demographics, adverse_events), loaded_at
+    except (sqlite3.DatabaseError, pd.errors.DatabaseError):
+        # Only a missing database or table falls back to demo data; a missing
+        # dependency such as pyarrow should fail instead of hiding the real data
+        st.warning("Clinical database not found; showing a synthetic demo cohort. Run the ETL pipeline to load real data.")
         # Enhanced demo data
         np.random.seed(42)
         demographics = pd.DataFrame({
@@ -63,24 +80,90 @@ def load_clinical_data():
             'related_to_study_drug': np.random.choice(['Yes', 'No', 'Possibly'], 168)
         })
         
-        return demographics, adverse_events
+        return *apply_categorical_dtypes(demographics, adverse_events), loaded_at
+
+@st.cache_data
+def compute_kpis(data_key, _demographics, _adverse_events):
+    """Compute the metrics shared by several dashboard pages once per dataset"""
+    demographics, adverse_events = _demographics, _adverse_events
+    
+    # Data quality checks, one vectorized pass per column
+    # Missing ages become NaN, which fails both comparisons; they are counted as missing data
+    age = demographics['age'].to_numpy(dtype='float64', na_value=np.nan)
+    age_violations = int(((age < 18) | (age > 75)).sum())
+    missing_fields = int(demographics.isna().to_numpy().sum())
+    duplicate_ids = int(demographics['subject_id'].duplicated().sum())
+    
+    # Subject-level lookups for AE rows, used instead of merging the frames
+    subjects = demographics.drop_duplicates('subject_id').set_index('subject_id')
+    
+    # AEs with an onset before the subject's enrollment
+    ae_enrollment = pd.to_datetime(adverse_events['subject_id'].map(subjects['enrollment_date']))
+    date_violations = int((pd.to_datetime(adverse_events['onset_date']) < ae_enrollment).sum())
+    
+    # Data completeness
+    total_fields = len(demographics.columns) * len(demographics)
+    completeness = round((1 - missing_fields / total_fields) * 100, 1)
+    
+    # Protocol compliance (age violations)
+    protocol_compliance = round((1 - age_violations / len(demographics)) * 100, 1)
+    
+    # Site enrollment with AE counts
+    site_enrollment = demographics.groupby('site_id').size().reset_index(name='enrolled')
+    if not adverse_events.empty:
+        ae_sites = adverse_events['subject_id'].map(subjects['site_id']).dropna().astype(subjects['site_id'].dtype)
+        ae_by_site = ae_sites.value_counts().rename_axis('site_id').reset_index(name='total_aes')
+        site_enrollment = site_enrollment.merge(ae_by_site, on='site_id', how='left')
+        site_enrollment['total_aes'] = site_enrollment['total_aes'].fillna(0)
+    
+    return {
+        'data_key': data_key,
+        'completeness': completeness,
+        'protocol_compliance': protocol_compliance,
+        'quality_checks': {
+            'age_range': age_violations,
+            'missing_data': missing_fields,
+            'duplicate_ids': duplicate_ids,
+            'date_logic': date_violations
+        },
+        'site_enrollment': site_enrollment,
+        'active_sites': demographics['site_id'].nunique(),
+        'severity_counts': adverse_events['severity'].value_counts(),
+        'serious_aes': int((adverse_events['severity'] == 'Severe').sum())
+    }
+
+@st.cache_data
+def compute_ae_timeline(data_key, _adverse_events):
+    """Daily AE counts, resampled on the onset datetimes"""
+    return (
+        _adverse_events.assign(onset_date=pd.to_datetime(_adverse_events['onset_date']))
+        .set_index('onset_date')
+        .resample('D').size()
+        .rename('count')
+        .reset_index()
+        .rename(columns={'onset_date': 'date'})
+    )
 
-def create_impressive_enrollment_timeline():
+@st.cache_resource
+def create_impressive_enrollment_timeline(data_key, _demographics):
     """Create the impressive enrollment chart with milestones"""
-    demographics, _ = load_clinical_data()
-    demographics['enrollment_date'] = pd.to_datetime(demographics['enrollment_date'])
-    demographics = demographics.sort_values('enrollment_date')
+    # Rows are already in enrollment order (see load_clinical_data), so no re-sorting is needed
+    demographics = _demographics.assign(enrollment_date=pd.to_datetime(_demographics['enrollment_date']))
     
     fig = go.Figure()
     
+    # Cumulative enrollment per site, computed once for all sites
+    site_cumulative = (
+        demographics.groupby(['site_id', 'enrollment_date'], sort=False).size()
+        .groupby(level='site_id').cumsum()
+        .reset_index(name='cumulative')
+    )
+    
     # Enrollment by site
-    for site_id in sorted(demographics['site_id'].unique()):
-        site_data = demographics[demographics['site_id'] == site_id].copy()
-        site_data['cumulative'] = range(1, len(site_data) + 1)
-        
+    for site_id, site_data in site_cumulative.groupby('site_id'):
         fig.add_trace(go.Scatter(
             x=site_data['enrollment_date'],
-            y=site_data.groupby('enrollment_date').size().cumsum(),
+            y=site_data['cumulative'],
             mode='lines+markers',
             name=f'Site {site_id}',
             line=dict(width=3),
@@ -88,7 +171,7 @@ def create_impressive_enrollment_timeline():
         ))
     
     # Overall enrollment
-    overall_cumulative = demographics.groupby('enrollment_date').size().cumsum()
+    overall_cumulative = demographics.groupby('enrollment_date', sort=False).size().cumsum()
     fig.add_trace(go.Scatter(
         x=overall_cumulative.index,
         y=overall_cumulative.values,
@@ -101,12 +184,11 @@ def create_impressive_enrollment_timeline():
     # Target line
     start_date = demographics['enrollment_date'].min()
     end_date = demographics['enrollment_date'].max()
-    target_dates = pd.date_range(start_date, end_date, freq='D')
-    target_y = np.linspace(0, 200, len(target_dates))
     
+    # A straight line only needs its two endpoints
     fig.add_trace(go.Scatter(
-        x=target_dates,
-        y=target_y,
+        x=[start_date, end_date],
+        y=[0, 200],
         mode='lines',
         name='Target Enrollment',
         line=dict(dash='dash', color='red', width=3)
@@ -142,40 +224,32 @@ def create_impressive_enrollment_timeline():
     
     return fig
 
-def create_comprehensive_quality_dashboard():
+def create_comprehensive_quality_dashboard(kpis):
     """Create the impressive 4-panel quality dashboard WITHOUT subplots"""
-    demographics, adverse_events = load_clinical_data()
-    
-    # Calculate metrics
-    total_fields = len(demographics.columns) * len(demographics)
-    missing_fields = demographics.isnull().sum().sum()
-    completeness = round((1 - missing_fields / total_fields) * 100, 1)
-    
-    # Protocol compliance (age violations)
-    age_violations = len(demographics[(demographics['age'] < 18) | (demographics['age'] > 75)])
-    protocol_compliance = round((1 - age_violations / len(demographics)) * 100, 1)
-    
-    return completeness, protocol_compliance
+    return kpis['completeness'], kpis['protocol_compliance']
 
-def create_site_performance_bar():
+def create_site_performance_bar(kpis):
     """Site performance with color coding"""
-    demographics, adverse_events = load_clinical_data()
-    site_enrollment = demographics.groupby('site_id').size().reset_index(name='enrolled')
-    
-    # Add AE data
-    if not adverse_events.empty:
-        ae_by_site = adverse_events.merge(
-            demographics[['subject_id', 'site_id']], on='subject_id'
-        ).groupby('site_id').size().reset_index(name='total_aes')
-        site_enrollment = site_enrollment.merge(ae_by_site, on='site_id', how='left')
-        site_enrollment['total_aes'] = site_enrollment['total_aes'].fillna(0)
-    
-    fig = go.Figure()
+    site_enrollment = kpis['site_enrollment']
     
     # Color code based on performance
     colors = ['red' if x < 15 else 'yellow' if x < 25 else 'green' 
               for x in site_enrollment['enrolled']]
     
+    # Reuse this session's figure and only swap the bar data when the dataset changes
+    fig = st.session_state.get('site_fig')
+    if fig is not None:
+        if st.session_state.get('site_fig_key') != kpis['data_key']:
+            with fig.batch_update():
+                fig.data[0].x = site_enrollment['site_id']
+                fig.data[0].y = site_enrollment['enrolled']
+                fig.data[0].text = site_enrollment['enrolled']
+                fig.data[0].marker.color = colors
+            st.session_state['site_fig_key'] = kpis['data_key']
+        return fig
+    
+    fig = go.Figure()
+    
     fig.add_trace(go.Bar(
         x=site_enrollment['site_id'],
         y=site_enrollment['enrolled'],
@@ -193,14 +267,15 @@ def create_site_performance_bar():
         showlegend=False
     )
     
+    st.session_state['site_fig'] = fig
+    st.session_state['site_fig_key'] = kpis['data_key']
     return fig
 
-def create_ae_analysis_comprehensive():
+@st.cache_resource
+def create_ae_analysis_comprehensive(data_key, _kpis):
     """Comprehensive AE analysis"""
-    _, adverse_events = load_clinical_data()
-    
     # Severity pie chart
-    severity_counts = adverse_events['severity'].value_counts()
+    severity_counts = _kpis['severity_counts']
     fig = go.Figure(data=[
         go.Pie(
             labels=severity_counts.index,
@@ -218,6 +293,7 @@ def create_ae_analysis_comprehensive():
     
     return fig
 
+@st.cache_resource
 def create_query_resolution_pie():
     """Query resolution status"""
     query_data = {
@@ -242,14 +318,11 @@ def create_query_resolution_pie():
     
     return fig
 
-def create_individual_gauges():
+@st.cache_resource
+def create_individual_gauges(data_key, _kpis):
     """Create individual gauge charts to prevent overlap"""
-    demographics, _ = load_clinical_data()
-    
     # Data completeness
-    total_fields = len(demographics.columns) * len(demographics)
-    missing_fields = demographics.isnull().sum().sum()
-    completeness = round((1 - missing_fields / total_fields) * 100, 1)
+    completeness = _kpis['completeness']
     
     completeness_fig = go.Figure(go.Indicator(
         mode="gauge+number+delta",
@@ -274,8 +347,7 @@ def create_individual_gauges():
     completeness_fig.update_layout(height=350)
     
     # Protocol compliance
-    age_violations = len(demographics[(demographics['age'] < 18) | (demographics['age'] > 75)])
-    protocol_compliance = round((1 - age_violations / len(demographics)) * 100, 1)
+    protocol_compliance = _kpis['protocol_compliance']
     
     protocol_fig = go.Figure(go.Indicator(
         mode="gauge+number+delta",
@@ -330,20 +402,23 @@ def main():
     st.sidebar.markdown(f"**Last Updated:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     
     # Load data
-    demographics, adverse_events = load_clinical_data()
+    # The load time is a cheap cache key that changes whenever the data is reloaded,
+    # so Streamlit never hashes full frames
+    demographics, adverse_events, loaded_at = load_clinical_data()
+    kpis = compute_kpis(loaded_at, demographics, adverse_events)
     
     if page == "Executive Summary":
-        show_executive_summary(demographics, adverse_events)
+        show_executive_summary(demographics, adverse_events, kpis)
     elif page == "Data Quality Monitoring":
-        show_data_quality_monitoring(demographics, adverse_events)
+        show_data_quality_monitoring(demographics, adverse_events, kpis)
     elif page == "Adverse Events Analysis":
-        show_adverse_events_analysis(demographics, adverse_events)
+        show_adverse_events_analysis(demographics, adverse_events, kpis)
     elif page == "Site Performance":
-        show_site_performance(demographics, adverse_events)
+        show_site_performance(demographics, adverse_events, kpis)
     elif page == "CDISC Compliance":
         show_cdisc_compliance(demographics, adverse_events)
 
-def show_executive_summary(demographics, adverse_events):
+def show_executive_summary(demographics, adverse_events, kpis):
     st.header("📊 Executive Summary Dashboard")
     
     # Key metrics with impressive styling
@@ -352,34 +427,32 @@ def show_executive_summary(demographics, adverse_events):
     with col1:
         st.metric("Total Subjects", len(demographics), delta="+0")
     with col2:
-        st.metric("Active Sites", demographics['site_id'].nunique(), delta=None)
+        st.metric("Active Sites", kpis['active_sites'], delta=None)
     with col3:
         st.metric("Total AEs", len(adverse_events), delta="+0")
     with col4:
         st.metric("Data Completeness", "100.0%", delta="+5.0%")
     with col5:
-        serious_aes = len(adverse_events[adverse_events['severity'] == 'Severe'])
-        st.metric("Serious AEs", serious_aes, delta=None)
+        st.metric("Serious AEs", kpis['serious_aes'], delta=None)
     
     # Impressive enrollment timeline
     st.markdown("### 📈 Study Enrollment Progress")
-    enrollment_fig = create_impressive_enrollment_timeline()
+    enrollment_fig = create_impressive_enrollment_timeline(kpis['data_key'], demographics)
     st.plotly_chart(enrollment_fig, use_container_width=True)
     
     # Spacing
     st.markdown("<br>", unsafe_allow_html=True)
     
     # Two-column layout for quality dashboard
+    completeness_fig, protocol_fig = create_individual_gauges(kpis['data_key'], kpis)
     col1, col2 = st.columns(2)
     
     with col1:
         st.markdown("### 📊 Data Completeness")
-        completeness_fig, _ = create_individual_gauges()
         st.plotly_chart(completeness_fig, use_container_width=True)
     
     with col2:
         st.markdown("### ✅ Protocol Compliance")
-        _, protocol_fig = create_individual_gauges()
         st.plotly_chart(protocol_fig, use_container_width=True)
     
     # Spacing
@@ -389,55 +462,54 @@ def show_executive_summary(demographics, adverse_events):
     col1, col2 = st.columns(2)
     
     with col1:
-        site_fig = create_site_performance_bar()
+        site_fig = create_site_performance_bar(kpis)
         st.plotly_chart(site_fig, use_container_width=True)
     
     with col2:
         query_fig = create_query_resolution_pie()
         st.plotly_chart(query_fig, use_container_width=True)
 
-def show_data_quality_monitoring(demographics, adverse_events):
+def show_data_quality_monitoring(demographics, adverse_events, kpis):
     st.header("🔍 Data Quality Monitoring")
     
     # Quality gauges
+    completeness_fig, protocol_fig = create_individual_gauges(kpis['data_key'], kpis)
     col1, col2 = st.columns(2)
     
     with col1:
-        completeness_fig, _ = create_individual_gauges()
         st.plotly_chart(completeness_fig, use_container_width=True)
     
     with col2:
-        _, protocol_fig = create_individual_gauges()
         st.plotly_chart(protocol_fig, use_container_width=True)
     
     # Validation results table
     st.subheader("✅ Automated Validation Results")
+    checks = kpis['quality_checks']
+    issues_found = [checks['age_range'], checks['missing_data'], checks['duplicate_ids'], checks['date_logic'], checks['age_range']]
     validation_data = {
         'Validation Check': ['Age Range (18-75)', 'Missing Data Detection', 'Duplicate Subject IDs', 'Date Logic Validation', 'Protocol Compliance'],
-        'Status': ['✅ Passed', '✅ Passed', '✅ Passed', '✅ Passed', '✅ Passed'],
+        'Status': ['✅ Passed' if issues == 0 else '⚠️ Review' for issues in issues_found],
         'Records Checked': [len(demographics), len(demographics), len(demographics), len(adverse_events), len(demographics)],
-        'Issues Found': [0, 0, 0, 0, 0],
+        'Issues Found': issues_found,
         'ICH-GCP Reference': ['4.1.1', '5.5.3', '4.1.3', '5.5.1', '4.1.1']
     }
     
     validation_df = pd.DataFrame(validation_data)
     st.dataframe(validation_df, use_container_width=True)
 
-def show_adverse_events_analysis(demographics, adverse_events):
+def show_adverse_events_analysis(demographics, adverse_events, kpis):
     st.header("⚠️ Comprehensive Adverse Events Analysis")
     
     # AE charts
     col1, col2 = st.columns(2)
     
     with col1:
-        ae_fig = create_ae_analysis_comprehensive()
+        ae_fig = create_ae_analysis_comprehensive(kpis['data_key'], kpis)
         st.plotly_chart(ae_fig, use_container_width=True)
     
     with col2:
         # AE timeline
-        adverse_events['onset_date'] = pd.to_datetime(adverse_events['onset_date'])
-        ae_timeline = adverse_events.groupby(adverse_events['onset_date'].dt.date).size().reset_index()
-        ae_timeline.columns = ['date', 'count']
+        ae_timeline = compute_ae_timeline(kpis['data_key'], adverse_events)
         
         timeline_fig = px.line(ae_timeline, x='date', y='count', title='📅 AE Timeline Analysis')
         timeline_fig.update_layout(height=400)
@@ -445,14 +517,13 @@ def show_adverse_events_analysis(demographics, adverse_events):
     
     # AE summary table
     st.subheader("📋 Detailed AE Analysis")
-    ae_summary = adverse_events.groupby(['severity', 'related_to_study_drug']).size().reset_index(name='count')
-    ae_pivot = ae_summary.pivot(index='severity', columns='related_to_study_drug', values='count').fillna(0)
+    ae_pivot = pd.crosstab(adverse_events['severity'], adverse_events['related_to_study_drug'])
     st.dataframe(ae_pivot, use_container_width=True)
 
-def show_site_performance(demographics, adverse_events):
+def show_site_performance(demographics, adverse_events, kpis):
     st.header("🏢 Site Performance Analysis")
     
-    site_fig = create_site_performance_bar()
+    site_fig = create_site_performance_bar(kpis)
     st.plotly_chart(site_fig, use_container_width=True)
     
     # Site metrics table
@@ -5,11 +5,16 @@ import sqlite3
 
 st.title("Clinical Trial Dashboard")
 
+@st.cache_data(ttl=300)
+def load_data():
+    conn = sqlite3.connect('data/clinical_data.db')
+    demographics = pd.read_sql('SELECT * FROM demographics', conn, dtype_backend='pyarrow')
+    adverse_events = pd.read_sql('SELECT * FROM adverse_events', conn, dtype_backend='pyarrow')
+    conn.close()
+    return demographics, adverse_events
+
 # Load data
-conn = sqlite3.connect('data/clinical_data.db')
-demographics = pd.read_sql('SELECT * FROM demographics', conn)
-adverse_events = pd.read_sql('SELECT * FROM adverse_events', conn)
-conn.close()
+demographics, adverse_events = load_data()
 
 # Show metrics
 st.metric("Total Subjects", len(demographics))
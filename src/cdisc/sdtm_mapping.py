@@ -4,6 +4,7 @@ CDISC SDTM Data Mapping System
 """
 
 import pandas as pd
+import numpy as np
 import sqlite3
 import logging
 
@@ -16,22 +17,29 @@ class CDISCSDTMMapper:
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
     
-    def load_source_data(self, table_name):
+    def load_source_data(self, table_name, columns=None):
+        cols = ', '.join(columns) if columns else '*'
         with sqlite3.connect(self.db_path) as conn:
-            return pd.read_sql(f"SELECT * FROM {table_name}", conn)
+            return pd.read_sql(f"SELECT {cols} FROM {table_name}", conn)
     
     def map_demographics_dm(self):
         self.logger.info("Mapping Demographics to CDISC DM domain")
         
-        source_dm = self.load_source_data('demographics')
-        dm = pd.DataFrame()
+        source_dm = self.load_source_data(
+            'demographics', ['subject_id', 'age', 'gender', 'enrollment_date', 'treatment_arm']
+        )
+        dm = pd.DataFrame(index=source_dm.index)
         
         # CDISC SDTM DM domain mapping
         dm['STUDYID'] = 'DEMO-001'
         dm['DOMAIN'] = 'DM'
-        dm['USUBJID'] = 'DEMO-001-' + source_dm['subject_id'].astype(str).str.zfill(4)
-        dm['SUBJID'] = source_dm['subject_id'].astype(str)
-        dm['RFSTDTC'] = pd.to_datetime(source_dm['enrollment_date']).dt.strftime('%Y-%m-%d')
+        # Build identifier and date strings as whole NumPy arrays
+        subject_ids = source_dm['subject_id'].to_numpy().astype(str)
+        dm['USUBJID'] = np.char.add('DEMO-001-', np.char.zfill(subject_ids, 4))
+        dm['SUBJID'] = subject_ids
+        enrollment_dates = pd.to_datetime(source_dm['enrollment_date']).to_numpy().astype('datetime64[D]')
+        # Missing dates stay missing rather than becoming the string 'NaT'
+        dm['RFSTDTC'] = np.where(np.isnat(enrollment_dates), None, enrollment_dates.astype(str))
         dm['AGE'] = source_dm['age']
         dm['AGEU'] = 'YEARS'
         dm['SEX'] = source_dm['gender']
@@ -39,7 +47,7 @@ class CDISCSDTMMapper:
         
         return dm
     
-    def export_sdtm_domains(self):
+    def export_sdtm_domains(self, write_csv=True):
         self.logger.info("Exporting SDTM domains")
         
         dm = self.map_demographics_dm()
@@ -48,8 +56,15 @@ class CDISCSDTMMapper:
         import os
         os.makedirs('output/sdtm', exist_ok=True)
         
+        # Low-cardinality columns are stored dictionary-encoded in Parquet
+        for col in ['STUDYID', 'DOMAIN', 'AGEU', 'SEX', 'ARM']:
+            dm[col] = dm[col].astype('category')
+        
         # Export DM domain
-        dm.to_csv('output/sdtm/dm.csv', index=False)
+        dm.to_parquet('output/sdtm/dm.parquet', engine='pyarrow', compression='snappy', index=False)
+        if write_csv:
+            # CSV sidecar for regulatory submission
+            dm.to_csv('output/sdtm/dm.csv', index=False)
         
         print("✅ CDISC SDTM Export Complete:")
         print(f"  DM Domain: {len(dm)} records")
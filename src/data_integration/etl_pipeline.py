@@ -8,14 +8,23 @@ import pandas as pd
 import numpy as np
 import sqlite3
 import logging
-from datetime import datetime, timedelta
+import argparse
+import sys
+from datetime import datetime
 from pathlib import Path
 
+# The indexes, change-tracking tables and triggers are defined by the validator that reads them
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'quality_control'))
+from data_validation import VALIDATION_RULES, install_change_tracking, install_rule_indexes
+
 class ClinicalDataETL:
-    def __init__(self):
+    def __init__(self, track_changes=False):
         self.setup_logging()
         self.db_path = 'data/clinical_data.db'
         self.mimic_path = Path('data/raw')
+        # Opt-in: the triggers add one counter update to every later row write, in
+        # exchange for ClinicalDataValidator reusing results while a table is unchanged
+        self.track_changes = track_changes
         
     def setup_logging(self):
         logging.basicConfig(
@@ -29,13 +38,26 @@ class ClinicalDataETL:
         self.logger.info("Loading MIMIC-III data...")
         
         tables = {}
-        key_files = ['PATIENTS.csv', 'ADMISSIONS.csv', 'LABEVENTS.csv', 'PRESCRIPTIONS.csv']
         
-        for file in key_files:
+        # Only the columns used by create_clinical_trial_data are read
+        key_files = {
+            'PATIENTS.csv': {
+                'usecols': ['subject_id', 'gender', 'dob'],
+                'dtype': {'subject_id': 'int64', 'gender': 'category'},
+                'parse_dates': ['dob']
+            },
+            'ADMISSIONS.csv': {
+                'usecols': ['subject_id'],
+                'dtype': {'subject_id': 'int64'},
+                'parse_dates': None
+            }
+        }
+        
+        for file, read_options in key_files.items():
             file_path = self.mimic_path / file
             if file_path.exists():
                 table_name = file.replace('.csv', '').lower()
-                tables[table_name] = pd.read_csv(file_path)
+                tables[table_name] = pd.read_csv(file_path, **read_options)
                 self.logger.info(f"Loaded {table_name}: {len(tables[table_name])} records")
         
         return tables
@@ -64,36 +86,66 @@ class ClinicalDataETL:
         demographics['treatment_arm'] = np.random.choice(['Active', 'Control'], len(demographics))
         
         # Create adverse events from this patient population
-        adverse_events = []
         ae_terms = ['Nausea', 'Fatigue', 'Diarrhea', 'Headache', 'Rash', 'Dizziness', 'Vomiting', 'Constipation']
         
-        for _, patient in demographics.iterrows():
-            n_aes = np.random.poisson(2)
-            for _ in range(n_aes):
-                adverse_events.append({
-                    'subject_id': patient['subject_id'],
-                    'ae_term': np.random.choice(ae_terms),
-                    'severity': np.random.choice(['Mild', 'Moderate', 'Severe'], p=[0.6, 0.3, 0.1]),
-                    'onset_date': patient['enrollment_date'] + timedelta(days=np.random.randint(1, 180)),
-                    'related_to_study_drug': np.random.choice(['Yes', 'No', 'Possibly'], p=[0.3, 0.5, 0.2])
-                })
+        # Draw every subject's AE count at once and repeat subject rows per event
+        n_aes = np.random.poisson(2, len(demographics))
+        total_aes = int(n_aes.sum())
+        enrollment = np.repeat(demographics['enrollment_date'].to_numpy(), n_aes)
+        onset_offsets = pd.to_timedelta(np.random.randint(1, 180, total_aes), unit='D')
+        
+        adverse_events = pd.DataFrame({
+            'subject_id': np.repeat(demographics['subject_id'].to_numpy(), n_aes),
+            'ae_term': np.random.choice(ae_terms, total_aes),
+            'severity': np.random.choice(['Mild', 'Moderate', 'Severe'], total_aes, p=[0.6, 0.3, 0.1]),
+            'onset_date': enrollment + onset_offsets,
+            'related_to_study_drug': np.random.choice(['Yes', 'No', 'Possibly'], total_aes, p=[0.3, 0.5, 0.2])
+        })
         
         # Return cleaned datasets
         final_demographics = demographics[['subject_id', 'age', 'gender', 'enrollment_date', 'site_id', 'treatment_arm']].copy()
         
         return {
             'demographics': final_demographics,
-            'adverse_events': pd.DataFrame(adverse_events)
+            'adverse_events': adverse_events
         }
     
-    def save_to_database(self, data):
+    def save_to_database(self, data, chunksize=10_000):
         """Save processed data to SQLite database"""
         self.logger.info("Saving data to database...")
         
         with sqlite3.connect(self.db_path) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            
+            # Every table is replaced in one transaction, committed when the connection
+            # block exits; the DDL is issued here because to_sql would commit it early
+            conn.execute("BEGIN")
             for table_name, df in data.items():
-                df.to_sql(table_name, conn, if_exists='replace', index=False)
+                conn.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+                conn.execute(pd.io.sql.get_schema(df, table_name, con=conn))
+                
+                # Store datetimes as text the same way to_sql does; other columns are used as-is
+                datetime_cols = set(df.select_dtypes(include='datetime').columns)
+                values = [df[col].dt.strftime('%Y-%m-%d %H:%M:%S') if col in datetime_cols else df[col]
+                          for col in df.columns]
+                
+                columns = ', '.join(f'"{col}"' for col in df.columns)
+                placeholders = ', '.join('?' * len(df.columns))
+                insert_sql = f'INSERT INTO "{table_name}" ({columns}) VALUES ({placeholders})'
+                
+                for start in range(0, len(df), chunksize):
+                    batch = [col.iloc[start:start + chunksize].tolist() for col in values]
+                    conn.executemany(insert_sql, zip(*batch))
                 self.logger.info(f"Saved {table_name}: {len(df)} records")
+            
+            # Built once after the bulk insert, so validation itself never writes
+            install_rule_indexes(conn, [rule for rule in VALIDATION_RULES if rule['table'] in data])
+            
+            if self.track_changes:
+                # Installed after the bulk insert, so loading the data does not fire the triggers
+                install_change_tracking(conn, data)
     
     def run_pipeline(self):
         """Execute the complete ETL pipeline"""
@@ -115,5 +167,9 @@ class ClinicalDataETL:
         print(f"💾 Database saved to: {self.db_path}")
 
 if __name__ == "__main__":
-    etl = ClinicalDataETL()
+    parser = argparse.ArgumentParser(description="Build the clinical trial database from MIMIC-III")
+    parser.add_argument('--track-changes', action='store_true',
+                        help="count writes to each table so validation can reuse unchanged results")
+    args = parser.parse_args()
+    etl = ClinicalDataETL(track_changes=args.track_changes)
     etl.run_pipeline()
@@ -3,52 +3,514 @@
 Clinical Data Quality Control and Validation System
 """
 
-import pandas as pd
+import ast
 import numpy as np
 import sqlite3
+import hashlib
+import json
 import logging
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+from dataclasses import asdict, dataclass
 from datetime import datetime
+from functools import lru_cache
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+try:
+    import numexpr as ne
+except ImportError:
+    ne = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# Row-level rules; each expr is evaluated with the column values bound to `a` and must
+# follow the grammar check_rule_expr accepts.
+# Range rules give 'bounds' instead, the closed range of values that pass; their
+# expr is generated by rule_expr, and the bounds let scans be skipped or answered
+# from a sorted column.
+VALIDATION_RULES = [
+    {
+        'table': 'demographics',
+        'column': 'age',
+        'dtype': 'int32',
+        'rule': 'age_range',
+        'bounds': (18, 120),
+        'severity': 'Error',
+        'message': '{count} subjects with invalid age'
+    }
+]
+
+# Rule results from earlier runs, reused while a table is unchanged
+RESULTS_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'cdms', 'validation.json')
+
+# Per-table write counter, installed by install_change_tracking; without it a table's
+# results are never cached, since in-place UPDATEs could not be detected
+CHANGES_TABLE = 'cdms_table_changes'
+CHANGE_EVENTS = ('INSERT', 'UPDATE', 'DELETE')
+
+def change_trigger_name(table_name, event):
+    return f"cdms_{table_name}_{event.lower()}"
+
+def install_rule_indexes(conn, rules=VALIDATION_RULES):
+    """Index each ruled column, so the validator's MIN/MAX and range predicates are index seeks"""
+    for table_name, column in dict.fromkeys((rule['table'], rule['column']) for rule in rules):
+        conn.execute(f'CREATE INDEX IF NOT EXISTS "idx_{table_name}_{column}" ON "{table_name}"("{column}")')
+
+def install_change_tracking(conn, tables):
+    """Count later writes to each table, so the validator can tell when it changed"""
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {CHANGES_TABLE} (
+            table_name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )""")
+    for table_name in tables:
+        conn.execute(f"INSERT OR IGNORE INTO {CHANGES_TABLE} (table_name) VALUES (?)", (table_name,))
+        for event in CHANGE_EVENTS:
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {change_trigger_name(table_name, event)} AFTER {event} ON "{table_name}"
+                BEGIN
+                    UPDATE {CHANGES_TABLE} SET version = version + 1 WHERE table_name = '{table_name}';
+                END""")
+
+_KERNEL_TEMPLATE = """
+def rule_kernel(values):
+    count = 0
+    for i in range(values.size):
+        a = values[i]
+        if {expr}:
+            count += 1
+    return count
+"""
+
+# The expr grammar every backend evaluates the same way, element-wise: arithmetic on
+# `a` and numbers, one comparison per operand pair, and & | ~ between comparisons
+_ARITHMETIC_OPS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Mod)
+_COMPARE_OPS = (ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.Eq, ast.NotEq)
+
+def _check_value(node, expr):
+    if isinstance(node, ast.Name) and node.id == 'a':
+        return
+    if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+        return
+    if isinstance(node, ast.BinOp) and isinstance(node.op, _ARITHMETIC_OPS):
+        _check_value(node.left, expr)
+        _check_value(node.right, expr)
+        return
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        _check_value(node.operand, expr)
+        return
+    raise ValueError(f"Unsupported value {ast.unparse(node)!r} in rule expression {expr!r}")
+
+def _check_condition(node, expr):
+    if isinstance(node, ast.Compare) and len(node.ops) == 1 and isinstance(node.ops[0], _COMPARE_OPS):
+        _check_value(node.left, expr)
+        _check_value(node.comparators[0], expr)
+        return
+    if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.BitAnd, ast.BitOr)):
+        _check_condition(node.left, expr)
+        _check_condition(node.right, expr)
+        return
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Invert):
+        _check_condition(node.operand, expr)
+        return
+    raise ValueError(f"Unsupported condition {ast.unparse(node)!r} in rule expression {expr!r}; "
+                     "combine comparisons with & | ~")
+
+def check_rule_expr(expr):
+    """Raise ValueError unless a rule expression is in the shared grammar"""
+    try:
+        tree = ast.parse(expr, mode='eval')
+    except SyntaxError as e:
+        raise ValueError(f"Invalid rule expression {expr!r}: {e.msg}") from None
+    _check_condition(tree.body, expr)
+
+def rule_expr(rule):
+    """A rule's violation expression, derived from its bounds for range rules"""
+    if 'bounds' not in rule:
+        check_rule_expr(rule['expr'])
+        return rule['expr']
+    if 'expr' in rule:
+        raise ValueError(f"Rule {rule['rule']!r} must give either 'expr' or 'bounds', not both")
+    low, high = rule['bounds']
+    return f"(a < {low}) | (a > {high})"
+
+@lru_cache(maxsize=None)
+def compile_rule(expr):
+    """Specialize a rule expression, once, into a function counting its violations"""
+    if njit is not None:
+        # Generate a scalar loop for this expression and JIT it; nogil lets
+        # table validators in the thread pool scan concurrently
+        namespace = {}
+        exec(_KERNEL_TEMPLATE.format(expr=expr), namespace)
+        return njit(nogil=True)(namespace['rule_kernel'])
+    
+    if ne is not None:
+        # numexpr fuses the comparisons and the count into one blocked, multi-threaded pass
+        count_expr = f"sum(where({expr}, 1, 0))"
+        return lambda a: ne.evaluate(count_expr, local_dict={'a': a})
+    
+    code = compile(expr, '<rule>', 'eval')
+    return lambda a: np.count_nonzero(eval(code, {}, {'a': a}))
+
+def narrowest_int_dtype(low, high):
+    """Smallest signed integer dtype that holds every value in [low, high]"""
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+@dataclass(slots=True, frozen=True)
+class Violation:
+    table: str
+    rule: str
+    violations: int
+    severity: str
+    message: str
+
+# Columnar layout of validation_results; the low-cardinality labels are dictionary-encoded
+RESULTS_SCHEMA = pa.schema([
+    ('table', pa.dictionary(pa.int32(), pa.string())),
+    ('rule', pa.dictionary(pa.int32(), pa.string())),
+    ('violations', pa.int64()),
+    ('severity', pa.dictionary(pa.int32(), pa.string())),
+    ('message', pa.string())
+]) if pa is not None else None
 
 class ClinicalDataValidator:
-    def __init__(self, db_path='data/clinical_data.db'):
+    def __init__(self, db_path='data/clinical_data.db', chunksize=200_000, rules=VALIDATION_RULES,
+                 results_cache=RESULTS_CACHE_PATH):
+        # Every thread that reads gets its own connection, so each can hold its own snapshot
+        self._connections = []
+        self._local = threading.local()
+        self._cache_lock = threading.Lock()
         self.db_path = db_path
+        self.rules = rules
+        # Keyed by table and column too, so a rule name may be reused across columns
+        self._compiled_rules = {(rule['table'], rule['column'], rule['rule']): compile_rule(rule_expr(rule))
+                                for rule in rules}
+        self.chunksize = chunksize
+        self._sorted_cols = {}
         self.validation_results = []
+        self.results_cache = results_cache
         self.setup_logging()
+        self._results = self.load_results_cache()
+        self._results_changed = False
         
     def setup_logging(self):
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
     
-    def load_data(self, table_name):
-        with sqlite3.connect(self.db_path) as conn:
-            return pd.read_sql(f"SELECT * FROM {table_name}", conn)
+    @property
+    def conn(self):
+        """This thread's SQLite connection, opened on first use"""
+        conn = getattr(self._local, 'conn', None)
+        return conn if conn is not None else self.connect()
     
-    def validate_demographics(self):
+    def connect(self):
+        """Open a connection for the calling thread, tuned for repeated read scans"""
+        # close() may run on another thread than the one that opened it. Only per-connection
+        # PRAGMAs are set: validation never writes, so it works on read-only copies too.
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.executescript("""
+            PRAGMA cache_size=-200000;
+            PRAGMA mmap_size=268435456;
+            PRAGMA temp_store=MEMORY;
+        """)
+        with self._cache_lock:
+            self._connections.append(conn)
+        self._local.conn = conn
+        return conn
+    
+    @contextmanager
+    def read_snapshot(self):
+        """Run a group of reads against one consistent snapshot of the database"""
+        conn = self.conn
+        conn.execute("BEGIN")
+        try:
+            yield
+        finally:
+            conn.execute("COMMIT")
+    
+    def close(self):
+        with self._cache_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    def __del__(self):
+        self.close()
+    
+    def has_change_tracking(self, table_name):
+        """Whether the ETL installed the write counter and triggers for a table"""
+        expected = [CHANGES_TABLE] + [change_trigger_name(table_name, event) for event in CHANGE_EVENTS]
+        found = self.conn.execute(
+            f"SELECT COUNT(*) FROM sqlite_master WHERE name IN ({', '.join('?' * len(expected))})",
+            expected
+        ).fetchone()[0]
+        return found == len(expected)
+    
+    def iter_column(self, table_name, column, dtype=np.int32, where=None):
+        """Yield one column as NumPy arrays of up to chunksize values, bypassing pandas"""
+        query = f"SELECT {column} FROM {table_name}"
+        if where:
+            query += f" WHERE {where}"
+        cursor = self.conn.cursor()
+        cursor.arraysize = self.chunksize
+        cursor.execute(query)
+        try:
+            for batch in iter(cursor.fetchmany, []):
+                # Rows are 1-tuples, so the (n, 1) array ravels without a copy
+                yield np.array(batch, dtype=dtype).ravel()
+        finally:
+            cursor.close()
+    
+    def load_column(self, table_name, column, dtype=np.int32, where=None):
+        """Load a whole column as a single NumPy array"""
+        batches = list(self.iter_column(table_name, column, dtype=dtype, where=where))
+        return np.concatenate(batches) if batches else np.empty(0, dtype=dtype)
+    
+    def column_dtype(self, table_name, column, dtype):
+        """The rule's dtype, or float64 when an integer dtype would truncate stored values"""
+        dtype = np.dtype(dtype)
+        if np.issubdtype(dtype, np.integer):
+            # Casting REAL values would hide violations such as 120.5 becoming 120
+            non_integers = self.conn.execute(
+                f"SELECT COUNT(*) FROM {table_name} WHERE {column} IS NOT NULL AND typeof({column}) != 'integer'"
+            ).fetchone()[0]
+            if non_integers:
+                return np.dtype(np.float64)
+        return dtype
+    
+    def has_sorted_column(self, table_name, column, dtype, signature):
+        cached = self._sorted_cols.get((table_name, column, np.dtype(dtype)))
+        return signature is not None and cached is not None and cached[0] == signature
+    
+    def sorted_column(self, table_name, column, dtype=np.int32, signature=None):
+        """Non-NULL values of a column in ascending order, re-sorted when the table signature changes"""
+        key = (table_name, column, np.dtype(dtype))
+        if self.has_sorted_column(table_name, column, dtype, signature):
+            return self._sorted_cols[key][1]
+        # Stable sort is a radix sort for 8/16-bit integers, linear in the column size
+        values = np.sort(self.load_column(table_name, column, dtype=dtype,
+                                          where=f"{column} IS NOT NULL"), kind='stable')
+        if signature is None:
+            # Untracked tables could change without notice, so their sort is not kept
+            return values
+        with self._cache_lock:
+            self._sorted_cols[key] = (signature, values)
+        return values
+    
+    def refresh(self):
+        """Forget sorted columns and earlier results so the next run reads SQLite again"""
+        with self._cache_lock:
+            self._sorted_cols.clear()
+            self._results.clear()
+    
+    def load_results_cache(self):
+        """Read the results saved by earlier runs, if any"""
+        if not self.results_cache or not os.path.exists(self.results_cache):
+            return {}
+        try:
+            with open(self.results_cache) as f:
+                entries = json.load(f)
+            return {(entry['db_path'], entry['table']): (tuple(entry['signature']),
+                                                          [Violation(**issue) for issue in entry['violations']])
+                    for entry in entries}
+        except Exception as e:
+            self.logger.warning(f"Ignoring unreadable results cache {self.results_cache}: {e}")
+            return {}
+    
+    def save_results_cache(self):
+        """Write the cached results, if this run stored any"""
+        if not self.results_cache or not self._results_changed:
+            return
+        entries = [{'db_path': db_path, 'table': table_name, 'signature': list(signature),
+                    'violations': [asdict(issue) for issue in violations]}
+                   for (db_path, table_name), (signature, violations) in self._results.items()]
+        os.makedirs(os.path.dirname(self.results_cache), exist_ok=True)
+        # Write then rename, so an interrupted run never leaves a truncated cache
+        tmp_path = f"{self.results_cache}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.results_cache)
+        self._results_changed = False
+    
+    def table_signature(self, table_name, table_rules):
+        """Fingerprint of a table's rows and rules, or None when its writes are not tracked"""
+        if not self.has_change_tracking(table_name):
+            return None
+        # The trigger-maintained version covers in-place UPDATEs that row count and rowid
+        # miss; schema_version covers the table being dropped and recreated, e.g. by the
+        # ETL. One statement reads all of them from one snapshot.
+        row_count, max_rowid, version, schema_version = self.conn.execute(f"""
+            SELECT (SELECT COUNT(*) FROM {table_name}),
+                   (SELECT MAX(rowid) FROM {table_name}),
+                   (SELECT version FROM {CHANGES_TABLE} WHERE table_name = ?),
+                   (SELECT schema_version FROM pragma_schema_version)
+        """, (table_name,)).fetchone()
+        rules_hash = hashlib.sha256(repr(table_rules).encode()).hexdigest()
+        return (row_count, max_rowid, version, schema_version, rules_hash)
+    
+    def count_violations(self, table_name, column, column_rules, signature=None):
+        """Count each rule's violations on one column, scanning the column at most once"""
+        # Missing values violate every rule on the column; they are counted in SQLite
+        missing = self.conn.execute(
+            f"SELECT COUNT(*) FROM {table_name} WHERE {column} IS NULL"
+        ).fetchone()[0]
+        counts = [missing] * len(column_rules)
+        
+        # MIN/MAX is an index seek once install_rule_indexes has run; an all-NULL column has nothing left to scan
+        low, high = self.conn.execute(
+            f"SELECT MIN({column}), MAX({column}) FROM {table_name}"
+        ).fetchone()
+        if low is None:
+            return counts
+        # Rules whose passing bounds contain [low, high] cannot have violations
+        scan_rules = [i for i, rule in enumerate(column_rules)
+                      if not ('bounds' in rule and rule['bounds'][0] <= low and high <= rule['bounds'][1])]
+        if not scan_rules:
+            return counts
+        
+        # Narrow integer columns to the smallest dtype that fits their actual range
+        # (ages fit in int8), so each scan moves fewer bytes. column_dtype has already
+        # confirmed the values are integers, and MIN/MAX must be too before narrowing.
+        # Only bounds rules, which just compare values, may run narrowed: arithmetic in
+        # an expr would wrap around under the NumPy fallback.
+        dtype = self.column_dtype(table_name, column, column_rules[0]['dtype'])
+        if (np.issubdtype(dtype, np.integer) and isinstance(low, int) and isinstance(high, int)
+                and all('bounds' in column_rules[i] for i in scan_rules)):
+            dtype = narrowest_int_dtype(low, high)
+        
+        # Several range rules on one column share one sort, then cost O(log n) each
+        range_rules = [i for i in scan_rules if 'bounds' in column_rules[i]]
+        if len(range_rules) > 1 or self.has_sorted_column(table_name, column, dtype, signature):
+            values = self.sorted_column(table_name, column, dtype=dtype, signature=signature)
+            for i in range_rules:
+                low_bound, high_bound = column_rules[i]['bounds']
+                counts[i] += int(np.searchsorted(values, low_bound, 'left')
+                                 + values.size - np.searchsorted(values, high_bound, 'right'))
+            scan_rules = [i for i in scan_rules if i not in range_rules]
+        
+        # Only one batch of the column is in memory at a time
+        if not scan_rules:
+            return counts
+        # closing() releases the cursor even when a kernel raises mid-scan
+        with closing(self.iter_column(table_name, column, dtype=dtype,
+                                      where=f"{column} IS NOT NULL")) as batches:
+            for values in batches:
+                for i in scan_rules:
+                    kernel = self._compiled_rules[(table_name, column, column_rules[i]['rule'])]
+                    counts[i] += int(kernel(values))
+        return counts
+    
+    def apply_rules(self, table_name):
+        """Evaluate a table's row-level rules, streaming each column once in chunks"""
+        table_rules = [rule for rule in self.rules if rule['table'] == table_name]
+        cache_key = (os.path.abspath(self.db_path), table_name)
+        columns = dict.fromkeys(rule['column'] for rule in table_rules)
+        violations = []
+        
+        # The signature, MIN/MAX and scans must agree, or a value committed in between
+        # could fall outside the narrowed dtype
+        with self.read_snapshot():
+            signature = self.table_signature(table_name, table_rules)
+            cached = self._results.get(cache_key)
+            if signature is None:
+                self.logger.info(f"{table_name} has no change tracking, so its results are not cached")
+            elif cached is not None and cached[0] == signature:
+                self.logger.info(f"{table_name} unchanged since the last run, reusing its results")
+                return list(cached[1])
+            
+            for column in columns:
+                column_rules = [rule for rule in table_rules if rule['column'] == column]
+                counts = self.count_violations(table_name, column, column_rules, signature)
+                for rule, count in zip(column_rules, counts):
+                    if count:
+                        violations.append(Violation(
+                            table=table_name,
+                            rule=rule['rule'],
+                            violations=count,
+                            severity=rule['severity'],
+                            message=rule['message'].format(count=count)
+                        ))
+        
+        if signature is not None:
+            with self._cache_lock:
+                self._results[cache_key] = (signature, violations)
+                self._results_changed = True
+        return violations
+    
+    def _validate_demographics(self):
         self.logger.info("Validating demographics data")
-        df = self.load_data('demographics')
-        
-        # Age validation
-        age_violations = df[(df['age'] < 18) | (df['age'] > 120)]
-        if not age_violations.empty:
-            self.validation_results.append({
-                'table': 'demographics',
-                'rule': 'age_range',
-                'violations': len(age_violations),
-                'severity': 'Error',
-                'message': f'{len(age_violations)} subjects with invalid age'
-            })
+        return self.apply_rules('demographics')
+    
+    def validate_demographics(self):
+        """Check demographics, record the violations in validation_results and return them"""
+        violations = self._validate_demographics()
+        self.validation_results.extend(violations)
+        return violations
     
     def run_all_validations(self):
         self.logger.info("Starting data validation")
-        self.validate_demographics()
+        # Workers use the non-recording variants so results are merged on this thread only
+        validators = [self._validate_demographics]
+        
+        # Table checks are independent; each worker returns its own list, merged here
+        with ThreadPoolExecutor(max_workers=min(8, len(validators))) as executor:
+            for violations in executor.map(lambda validate: validate(), validators):
+                self.validation_results.extend(violations)
+        self.save_results_cache()
         
         if not self.validation_results:
             print("✅ All data quality checks passed!")
         else:
-            print("Data Quality Issues Found:")
-            for issue in self.validation_results:
-                print(f"- {issue['severity']}: {issue['message']}")
+            # Build the whole report first and write it in one call
+            report = "\n".join(f"- {issue.severity}: {issue.message}" for issue in self.validation_results)
+            sys.stdout.write("Data Quality Issues Found:\n" + report + "\n")
+    
+    def to_record_batch(self):
+        """Return validation_results as an Arrow RecordBatch"""
+        if pa is None:
+            raise ImportError("pyarrow is required for Arrow output")
+        columns = [[getattr(issue, field.name) for issue in self.validation_results]
+                   for field in RESULTS_SCHEMA]
+        return pa.RecordBatch.from_arrays(
+            [pa.array(values, type=field.type) for values, field in zip(columns, RESULTS_SCHEMA)],
+            schema=RESULTS_SCHEMA
+        )
+    
+    def to_pandas(self):
+        """Return validation_results as a DataFrame with categorical labels"""
+        return self.to_record_batch().to_pandas()
+    
+    def write_parquet(self, path='output/validation_results.parquet'):
+        """Write validation_results to a Parquet file"""
+        if pq is None:
+            raise ImportError("pyarrow is required for Parquet output")
+        batch = self.to_record_batch()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        pq.write_table(pa.Table.from_batches([batch]), path, compression='snappy')
+        self.logger.info(f"Validation results written to {path}")
 
 if __name__ == "__main__":
-    validator = ClinicalDataValidator()
-    validator.run_all_validations()
+    with ClinicalDataValidator() as validator:
+        validator.run_all_validations()
@@ -0,0 +1,202 @@
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'quality_control'))
+
+import data_validation
+from data_validation import ClinicalDataValidator, install_change_tracking, install_rule_indexes
+
+class ResultsCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, 'clinical_data.db')
+        self.cache_path = os.path.join(self.tmp_dir.name, 'validation.json')
+        
+        # A writer that stays open keeps the WAL in use, so a checkpointed WAL is
+        # rewritten from the start without the file sizes or mtimes changing
+        self.writer = sqlite3.connect(self.db_path)
+        self.writer.execute("PRAGMA journal_mode=WAL")
+        self.writer.execute("CREATE TABLE demographics (subject_id INTEGER, age INTEGER)")
+        self.writer.executemany("INSERT INTO demographics VALUES (?, ?)",
+                                [(i, 30 + i % 50) for i in range(100)])
+        self.writer.commit()
+    
+    def tearDown(self):
+        self.writer.close()
+        self.tmp_dir.cleanup()
+    
+    def validate(self):
+        with ClinicalDataValidator(self.db_path, results_cache=self.cache_path) as validator:
+            validator.run_all_validations()
+            return validator.validation_results
+    
+    def test_update_from_open_writer_invalidates_cached_pass(self):
+        install_change_tracking(self.writer, ['demographics'])
+        self.writer.commit()
+        self.validate()
+        self.writer.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        self.assertEqual(self.validate(), [])
+        with self.assertLogs('data_validation', level='INFO') as logs:
+            self.assertEqual(self.validate(), [])
+        self.assertTrue(any('reusing its results' in line for line in logs.output))
+        
+        self.writer.execute("UPDATE demographics SET age = 5 WHERE rowid <= 3")
+        self.writer.commit()
+        
+        results = self.validate()
+        self.assertEqual([(issue.rule, issue.violations) for issue in results], [('age_range', 3)])
+        with open(self.cache_path) as f:
+            self.assertEqual(json.load(f)[0]['violations'][0]['violations'], 3)
+    
+    def test_untracked_table_is_revalidated_and_left_unchanged(self):
+        schema = self.writer.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')").fetchall()
+        self.validate()
+        with self.assertLogs('data_validation', level='INFO') as logs:
+            self.assertEqual(self.validate(), [])
+        self.assertFalse(any('reusing its results' in line for line in logs.output))
+        self.assertEqual(
+            self.writer.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')").fetchall(),
+            schema
+        )
+        self.assertFalse(os.path.exists(self.cache_path))
+
+class RuleTestCase(unittest.TestCase):
+    """A demographics table and helpers for building rules against it"""
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, 'clinical_data.db')
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.execute("CREATE TABLE demographics (subject_id INTEGER, age INTEGER)")
+    
+    def tearDown(self):
+        self.conn.close()
+        self.tmp_dir.cleanup()
+    
+    def insert_ages(self, ages):
+        self.conn.executemany("INSERT INTO demographics VALUES (?, ?)", enumerate(ages))
+        self.conn.commit()
+    
+    def rule(self, name, column='age', **definition):
+        return dict({'table': 'demographics', 'column': column, 'dtype': 'int32', 'rule': name,
+                     'severity': 'Error', 'message': '{count} invalid'}, **definition)
+    
+    def count(self, rules, validator=None):
+        if validator is None:
+            with ClinicalDataValidator(self.db_path, results_cache=None, rules=rules) as validator:
+                return self.count(rules, validator)
+        return {issue.rule: issue.violations for issue in validator.apply_rules('demographics')}
+
+class RuleScanTest(RuleTestCase):
+    def test_expr_rule_is_not_narrowed(self):
+        # Under int8, 120 * 2 would wrap to -16 and pass
+        self.insert_ages([20, 90, 110, 120])
+        self.assertEqual(self.count([self.rule('doubled', expr='a * 2 > 200')]), {'doubled': 2})
+    
+    def test_sorted_range_counts_match_kernel_and_follow_updates(self):
+        install_change_tracking(self.conn, ['demographics'])
+        self.insert_ages([10, 17, 18, 30, 65, 66, 90, 121])
+        rules = [self.rule('adult', bounds=(18, 120)), self.rule('working_age', bounds=(18, 65))]
+        # A lone range rule on an unsorted column goes through the compiled kernel
+        kernel_counts = {**self.count(rules[:1]), **self.count(rules[1:])}
+        self.assertEqual(kernel_counts, {'adult': 3, 'working_age': 5})
+        
+        with ClinicalDataValidator(self.db_path, results_cache=None, rules=rules) as validator:
+            self.assertEqual(self.count(rules, validator), kernel_counts)
+            self.assertTrue(validator._sorted_cols)
+            
+            self.conn.execute("UPDATE demographics SET age = 50 WHERE age > 65")
+            self.conn.commit()
+            self.assertEqual(self.count(rules, validator), {'adult': 2, 'working_age': 2})
+    
+    def test_real_value_is_not_truncated_to_an_integer(self):
+        self.insert_ages([30, 120, 120.5])
+        self.assertEqual(self.count([self.rule('age_range', bounds=(18, 120))]), {'age_range': 1})
+    
+    def test_real_min_max_are_not_narrowed(self):
+        self.insert_ages([17.5, 18, 120, 120.5])
+        self.assertEqual(self.count([self.rule('age_range', bounds=(18, 120))]), {'age_range': 2})
+    
+    def test_rule_name_can_be_reused_across_columns(self):
+        self.insert_ages([10, 30, 130, 40])
+        rules = [self.rule('in_range', bounds=(18, 120)),
+                 self.rule('in_range', column='subject_id', expr='a > 2')]
+        with ClinicalDataValidator(self.db_path, results_cache=None, rules=rules) as validator:
+            counts = [issue.violations for issue in validator.apply_rules('demographics')]
+        self.assertEqual(counts, [2, 1])
+    
+    def test_rule_cannot_give_both_expr_and_bounds(self):
+        rule = self.rule('age_range', expr='a < 0', bounds=(18, 120))
+        with self.assertRaises(ValueError):
+            ClinicalDataValidator(self.db_path, results_cache=None, rules=[rule])
+    
+    def test_indexes_follow_the_rule_set(self):
+        self.conn.execute("CREATE TABLE vitals (subject_id INTEGER, heart_rate INTEGER)")
+        self.conn.execute("DROP TABLE demographics")
+        self.conn.commit()
+        rule = dict(self.rule('hr_range', column='heart_rate', bounds=(30, 220)), table='vitals')
+        install_rule_indexes(self.conn, [rule])
+        self.conn.commit()
+        indexes = self.conn.execute("SELECT tbl_name, name FROM sqlite_master WHERE type = 'index'").fetchall()
+        self.assertEqual(indexes, [('vitals', 'idx_vitals_heart_rate')])
+    
+    def test_validator_does_not_write_to_the_database(self):
+        self.insert_ages([10, 30])
+        schema = self.conn.execute("SELECT * FROM sqlite_master").fetchall()
+        journal_mode = self.conn.execute("PRAGMA journal_mode").fetchone()
+        self.assertEqual(self.count([self.rule('age_range', bounds=(18, 120))]), {'age_range': 1})
+        self.assertEqual(self.conn.execute("SELECT * FROM sqlite_master").fetchall(), schema)
+        self.assertEqual(self.conn.execute("PRAGMA journal_mode").fetchone(), journal_mode)
+    
+    def test_worker_thread_reads_while_another_snapshot_is_open(self):
+        self.insert_ages([10, 30])
+        rules = [self.rule('age_range', bounds=(18, 120))]
+        with ClinicalDataValidator(self.db_path, results_cache=None, rules=rules) as validator:
+            with validator.read_snapshot(), ThreadPoolExecutor(max_workers=1) as executor:
+                worker = executor.submit(validator.apply_rules, 'demographics')
+                self.assertEqual([issue.violations for issue in worker.result(timeout=5)], [1])
+    
+    def test_expressions_outside_the_grammar_are_rejected(self):
+        for expr in ['a > 100 and a < 200', '18 < a < 120', 'abs(a) > 3', 'a.sum() > 0', 'b > 1', 'a + 1', 'a >']:
+            with self.subTest(expr=expr), self.assertRaises(ValueError):
+                ClinicalDataValidator(self.db_path, results_cache=None, rules=[self.rule('bad', expr=expr)])
+
+class RuleBackendTest(RuleTestCase):
+    """The same expressions must count the same violations under every backend"""
+    EXPRESSIONS = {
+        'between': ('(a > 100) & (a < 200)', 2),
+        'not_minor': ('~(a < 18)', 5),
+        'doubled': ('a * 2 > 200', 3),
+        'even_over_100': ('(a % 2 == 0) & (-a < -100)', 3),
+        'quarter': ('a / 4 > 30', 2),
+    }
+    
+    def setUp(self):
+        super().setUp()
+        self.insert_ages([10, 30, 90, 110, 150, 250])
+        data_validation.compile_rule.cache_clear()
+        self.addCleanup(data_validation.compile_rule.cache_clear)
+    
+    def check_backend(self, njit, ne):
+        rules = [self.rule(name, expr=expr) for name, (expr, _) in self.EXPRESSIONS.items()]
+        with mock.patch.object(data_validation, 'njit', njit), mock.patch.object(data_validation, 'ne', ne):
+            self.assertEqual(self.count(rules), {name: count for name, (_, count) in self.EXPRESSIONS.items()})
+    
+    @unittest.skipUnless(data_validation.njit, "numba is not installed")
+    def test_numba(self):
+        self.check_backend(data_validation.njit, None)
+    
+    @unittest.skipUnless(data_validation.ne, "numexpr is not installed")
+    def test_numexpr(self):
+        self.check_backend(None, data_validation.ne)
+    
+    def test_numpy(self):
+        self.check_backend(None, None)
+
+if __name__ == '__main__':
+    unittest.main()